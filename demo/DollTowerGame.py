@@ -1,15 +1,59 @@
 import random
+import numpy as np
 import pandas as pd
 import gradio as gr
-from collections import defaultdict
 import tempfile
 from fastapi.middleware.cors import CORSMiddleware
-from openpyxl import load_workbook
+from numba import njit, prange
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
 from openpyxl.utils import get_column_letter
 from openpyxl.styles import PatternFill
 
 DEFAULT_COLORS = ["红", "橙", "黄", "绿", "蓝", "紫", "粉", "黑", "白", "棕", "灰", "金", "银"]
 
+# 塔位编码：-1 为空位，低6位是颜色编号，bit6 表示许愿已触发
+COLOR_MASK = 0x3F
+TRIG_FLAG = 0x40
+
+# 宝塔规格固定为9层：用模块常量让 Numba 做常量折叠并完全展开塔位循环
+TOWER_N = 9
+
+# 同色组边界：(0,3) (3,5) (5,7) (7,9)，在热循环中以字面量手动展开
+
+# 事件编号：热循环中只记录整数，文本在导出时再解码
+(EV_INIT, EV_WISH, EV_GROUP, EV_DUP, EV_GIFT, EV_GIFT_CLEAR,
+ EV_REFILL, EV_MILK, EV_END_NORMAL, EV_END_MAXROUND) = range(10)
+
+EVENT_PHASES = [
+    "初始化", "许愿补货", "组处理", "同色处理", "大礼包",
+    "大礼包", "新一轮放娃", "奶操作", "游戏结束", "游戏结束",
+]
+
+# 阶段名去重后的类别表及事件→阶段类别编码，用于构建 Categorical 列
+PHASE_NAMES = ["初始化", "许愿补货", "组处理", "同色处理", "大礼包", "新一轮放娃", "奶操作", "游戏结束"]
+EVENT_PHASE_CODES = np.array([PHASE_NAMES.index(p) for p in EVENT_PHASES], dtype=np.int8)
+
+EVENT_TEXTS = [
+    "初始放置 {a} 个娃娃",
+    "补充 {a} 个娃娃",
+    "第{a}组清除 {b} 个，补货 {b} 个",
+    "清除 {a} 个重复颜色，补货 {b} 个",
+    "获得全异色大礼包",
+    "宝塔清空，所有娃娃倒入收获筐",
+    "放置 {a} 个娃娃到宝塔",
+    "应用第{a}次奶，补充{b}个娃娃",
+    "清空宝塔，收获{a}个娃娃，正常终止",
+    "达到最大回合，清空宝塔收获{a}个娃娃",
+]
+
+# 日志行布局（int32）：回合、事件、9个塔位颜色、许愿位掩码、
+# 小筐数量、收获娃娃、大礼包数、塔上娃娃、事件参数a、事件参数b
+LOG_W = 18
+
+# 每局日志行数硬上限，超出后 _log_write 直接丢弃，保证内存随局数线性可控
+MAX_LOGS_PER_GAME = 2000
+
 
 def parse_doll_config(config_str):
     """解析娃娃配置字符串"""
@@ -41,303 +85,476 @@ def parse_doll_config(config_str):
     return colors, ratios
 
 
-class GameState:
-    """游戏状态管理类"""
-
-    def __init__(self, game_id, population, ratios, initial_draw, wish_colors, milk_counts):
-        self.game_id = game_id
-        self.population = population
-        self.ratios = ratios
-        self.wish_colors = wish_colors  # 许愿色改为列表
-        self.milk_counts = milk_counts  # 新增奶次数
-        self.milk_used = 0  # 已使用的奶次数
-
-        # 初始化状态
-        self.tower = [None] * 9  # 9层宝塔
-        self.small_basket = []
-        self.harvest_dolls = 0
-        self.harvest_gifts = 0
-        self.round_number = 0
-        self.logs = []
-
-        # 初始抽取
-        initial = random.choices(population, weights=ratios, k=initial_draw)
-        for i in range(min(9, len(initial))):
-            self.tower[i] = {"color": initial[i], "wish_triggered": False}
-        self.small_basket = initial[9:]
-
-        # 初始日志记录
-        self.log_event("初始化", f"初始放置 {len(initial)} 个娃娃")
-
-    def log_event(self, phase, event):
-        """记录游戏事件"""
-        tower_count = sum(1 for d in self.tower if d)
-        self.logs.append([
-            self.game_id,
-            self.round_number,
-            phase,
-            self.tower_str(),
-            len(self.small_basket),
-            self.harvest_dolls,
-            self.harvest_gifts,
-            tower_count,
-            event
-        ])
-
-    def tower_str(self):
-        """宝塔状态可视化"""
-        return " | ".join(
-            f"{d['color']: <3}{'*' if d['wish_triggered'] else ' '}" if d else "●   "
-            for d in self.tower
-        )
-
-    def process_wish(self):
-        """处理许愿色补货（支持多选）"""
-        wish_count = 0
-        for color in self.wish_colors:
-            wish_count += sum(
-                1 for d in self.tower
-                if d and d["color"] == color and not d["wish_triggered"]
-            )
-
-        if wish_count > 0:
-            # 标记已触发
-            for d in self.tower:
-                if d and d["color"] in self.wish_colors:
-                    d["wish_triggered"] = True
-
-            # 补货到小筐
-            new_dolls = random.choices(self.population, weights=self.ratios, k=wish_count)
-            self.small_basket.extend(new_dolls)
-            self.log_event("许愿补货", f"补充 {wish_count} 个娃娃")
-
-    def process_groups(self):
-        """处理同色组"""
-        groups = [(0, 3, 3), (3, 5, 2), (5, 7, 2), (7, 9, 2)]
-
-        for idx, (start, end, req) in enumerate(groups, 1):
-            group = self.tower[start:end]
-
-            # 检查是否填满且同色
-            if None in group:
-                continue
-
-            colors = set(d["color"] for d in group)
-            if len(colors) == 1:
-                # 收获娃娃
-                self.harvest_dolls += (end - start)
-
-                # 清空组
-                for i in range(start, end):
-                    self.tower[i] = None
-
-                # 补货到小筐
-                new_dolls = random.choices(self.population, weights=self.ratios, k=end - start)
-                self.small_basket.extend(new_dolls)
-
-                self.log_event("组处理", f"第{idx}组清除 {end - start} 个，补货 {len(new_dolls)} 个")
-
-    def process_duplicates(self):
-        """处理全塔重复颜色（修复补货逻辑）"""
-        color_counts = defaultdict(int)
-        for doll in self.tower:
-            if doll:
-                color_counts[doll["color"]] += 1
-
-        # 计算需要移除的颜色和补货数量
-        removed_colors = {color for color, count in color_counts.items() if count >= 2}
-        total_replenish = sum((count - 1) for color, count in color_counts.items() if count >= 2)
-
-        # 移除娃娃
+@njit(cache=True, boundscheck=False)
+def _draw1(cum):
+    """按累积权重抽取一个颜色编号"""
+    return np.searchsorted(cum, np.random.random())
+
+
+@njit(cache=True, boundscheck=False)
+def _fill_basket(cum, basket, bn, k):
+    """向小筐追加 k 个新抽取的娃娃，返回新的小筐数量"""
+    for i in range(k):
+        basket[bn + i] = _draw1(cum)
+    return bn + k
+
+
+@njit(cache=True, boundscheck=False)
+def _log_write(log, log_n, rnd, ev, tower, tower_n, basket_n, dolls, gifts, a, b):
+    """写入一行整型日志（塔状态按列快照，许愿标记打包成位掩码）"""
+    if log_n >= log.shape[0]:
+        return log_n
+    row = log[log_n]
+    row[0] = rnd
+    row[1] = ev
+    bits = 0
+    for i in range(TOWER_N):
+        x = tower[i]
+        if x >= 0:
+            row[2 + i] = x & COLOR_MASK
+            if x & TRIG_FLAG:
+                bits |= 1 << i
+        else:
+            row[2 + i] = -1
+    row[11] = bits
+    row[12] = basket_n
+    row[13] = dolls
+    row[14] = gifts
+    row[15] = tower_n
+    row[16] = a
+    row[17] = b
+    return log_n + 1
+
+
+@njit(inline='always', cache=True, boundscheck=False)
+def _no_duplicates(tower):
+    """位掩码判定塔上已放娃娃的颜色是否互异（最多支持64色）"""
+    m = 0
+    for i in range(TOWER_N):
+        x = tower[i]
+        if x < 0:
+            continue
+        bit = 1 << (x & COLOR_MASK)
+        if m & bit:
+            return False
+        m |= bit
+    return True
+
+
+@njit(inline='always', cache=True, boundscheck=False)
+def _process_group(cum, tower, tower_n, counts, basket, bn, log, log_n, rnd, dolls, gifts, gi, start, end):
+    """处理单个同色组（start/end 为字面量时整段被内联展开）"""
+    # 检查是否填满且同色（忽略许愿标记位）
+    first = tower[start]
+    same = first >= 0
+    if same:
+        fc = first & COLOR_MASK
+        for i in range(start + 1, end):
+            if tower[i] < 0 or tower[i] & COLOR_MASK != fc:
+                same = False
+                break
+
+    if same:
+        # 收获娃娃并清空组，计数同步递减
+        size = end - start
+        dolls += size
+        tower_n -= size
+        counts[first & COLOR_MASK] -= size
+        for i in range(start, end):
+            tower[i] = -1
+
+        # 补货到小筐
+        bn = _fill_basket(cum, basket, bn, size)
+        log_n = _log_write(log, log_n, rnd, EV_GROUP, tower, tower_n, bn, dolls, gifts, gi, size)
+    return bn, tower_n, dolls, log_n
+
+
+@njit(cache=True, boundscheck=False)
+def _process_round_phases(cum, wish_mask, n_colors, tower, tower_n, basket, bn, log, log_n, rnd, dolls, gifts):
+    """单次扫描融合许愿/同色组/重复颜色/大礼包四个阶段
+
+    一趟循环同时得到许愿命中数与每色计数；同色组清除时同步递减计数，
+    重复颜色阶段直接复用计数而不再扫塔。大礼包条件（塔满且九色互异）
+    成立时前两个阶段必然没有清除任何娃娃，故可由同一份快照判定。
+    各阶段对小筐抽取的先后顺序与原四个函数完全一致。
+    """
+    counts = np.zeros(n_colors, dtype=np.int32)
+    wish_count = 0
+    for i in range(TOWER_N):
+        x = tower[i]
+        if x >= 0:
+            c = x & COLOR_MASK
+            counts[c] += 1
+            if wish_mask[c] and not (x & TRIG_FLAG):
+                wish_count += 1
+
+    all_distinct = tower_n == 9 and _no_duplicates(tower)
+
+    # 处理许愿色补货（支持多选）
+    if wish_count > 0:
+        # 标记已触发
+        for i in range(TOWER_N):
+            x = tower[i]
+            if x >= 0 and wish_mask[x & COLOR_MASK]:
+                tower[i] = x | TRIG_FLAG
+
+        # 补货到小筐
+        bn = _fill_basket(cum, basket, bn, wish_count)
+        log_n = _log_write(log, log_n, rnd, EV_WISH, tower, tower_n, bn, dolls, gifts, wish_count, 0)
+
+    # 处理同色组：组边界是编译期常量，四次调用被完全展开
+    bn, tower_n, dolls, log_n = _process_group(
+        cum, tower, tower_n, counts, basket, bn, log, log_n, rnd, dolls, gifts, 1, 0, 3)
+    bn, tower_n, dolls, log_n = _process_group(
+        cum, tower, tower_n, counts, basket, bn, log, log_n, rnd, dolls, gifts, 2, 3, 5)
+    bn, tower_n, dolls, log_n = _process_group(
+        cum, tower, tower_n, counts, basket, bn, log, log_n, rnd, dolls, gifts, 3, 5, 7)
+    bn, tower_n, dolls, log_n = _process_group(
+        cum, tower, tower_n, counts, basket, bn, log, log_n, rnd, dolls, gifts, 4, 7, 9)
+
+    # 处理全塔重复颜色（每个颜色组补货n-1），复用上面维护的计数
+    total_replenish = 0
+    for c in range(n_colors):
+        if counts[c] >= 2:
+            total_replenish += counts[c] - 1
+
+    if total_replenish > 0:
         removed = 0
-        for i in range(len(self.tower)):
-            if self.tower[i] and self.tower[i]["color"] in removed_colors:
-                self.tower[i] = None
+        for i in range(TOWER_N):
+            x = tower[i]
+            if x >= 0 and counts[x & COLOR_MASK] >= 2:
+                tower[i] = -1
                 removed += 1
 
-        if removed > 0:
-            self.harvest_dolls += removed
-            # 按规则补货：每个颜色组补货n-1
-            new_dolls = random.choices(self.population, weights=self.ratios, k=total_replenish)
-            self.small_basket.extend(new_dolls)
-            self.log_event("同色处理", f"清除 {removed} 个重复颜色，补货 {total_replenish} 个")
-
-    def process_special_gift(self):
-        """处理特殊大礼包"""
-        dolls = [d for d in self.tower if d]
-        if len(dolls) == 9 and len(set(d["color"] for d in dolls)) == 9:
-            # 获得大礼包
-            self.harvest_gifts += 1
-            self.log_event("大礼包", "获得全异色大礼包")
-
-            # 将宝塔上的所有娃娃倒入收获筐
-            self.harvest_dolls += 9
-            self.tower = [None] * 9  # 清空宝塔
-            self.log_event("大礼包", "宝塔清空，所有娃娃倒入收获筐")
-
-    def refill_tower(self):
-        """补充娃娃到宝塔"""
-        if not self.small_basket:
-            return
-
-        # 打乱顺序后填充
-        random.shuffle(self.small_basket)
-        new_dolls = iter(self.small_basket)
-
-        # 填充空位
-        filled = 0
-        for i in range(9):
-            if self.tower[i] is None:
-                try:
-                    color = next(new_dolls)
-                    self.tower[i] = {"color": color, "wish_triggered": False}
-                    filled += 1
-                except StopIteration:
-                    break
-
-        # 更新小筐
-        self.small_basket = list(new_dolls)
-        if filled > 0:
-            self.log_event("新一轮放娃", f"放置 {filled} 个娃娃到宝塔")
-
-    def should_terminate(self):
-        """检查终止条件（支持多选许愿色）"""
-        # 检查小筐是否为空
-        if len(self.small_basket) > 0:
+        dolls += removed
+        tower_n -= removed
+        bn = _fill_basket(cum, basket, bn, total_replenish)
+        log_n = _log_write(log, log_n, rnd, EV_DUP, tower, tower_n, bn, dolls, gifts, removed, total_replenish)
+
+    # 处理特殊大礼包
+    if all_distinct:
+        # 获得大礼包
+        gifts += 1
+        log_n = _log_write(log, log_n, rnd, EV_GIFT, tower, tower_n, bn, dolls, gifts, 0, 0)
+
+        # 将宝塔上的所有娃娃倒入收获筐
+        dolls += 9
+        tower_n = 0
+        for i in range(TOWER_N):
+            tower[i] = -1
+        log_n = _log_write(log, log_n, rnd, EV_GIFT_CLEAR, tower, tower_n, bn, dolls, gifts, 0, 0)
+
+    return bn, tower_n, dolls, gifts, log_n
+
+
+@njit(cache=True, boundscheck=False)
+def _refill_tower(tower, tower_n, basket, bn, log, log_n, rnd, dolls, gifts):
+    """补充娃娃到宝塔"""
+    if bn == 0:
+        return tower_n, bn, log_n
+
+    # 小筐里的娃娃全部来自同分布的独立抽取，洗牌不改变分布，直接取用即可
+    # 填充空位：从小筐末尾按下标取用，剩余娃娃原地保留，无需搬移
+    filled = 0
+    for i in range(TOWER_N):
+        if tower[i] < 0:
+            if bn == 0:
+                break
+            bn -= 1
+            tower[i] = basket[bn]
+            filled += 1
+
+    tower_n += filled
+    if filled > 0:
+        log_n = _log_write(log, log_n, rnd, EV_REFILL, tower, tower_n, bn, dolls, gifts, filled, 0)
+    return tower_n, bn, log_n
+
+
+@njit(cache=True, boundscheck=False)
+def _should_terminate(wish_mask, tower, bn):
+    """检查终止条件（支持多选许愿色）"""
+    # 检查小筐是否为空
+    if bn > 0:
+        return False
+
+    # 检查许愿色是否全部触发
+    for i in range(TOWER_N):
+        x = tower[i]
+        if x >= 0 and wish_mask[x & COLOR_MASK] and not (x & TRIG_FLAG):
             return False
 
-        # 检查许愿色是否全部触发
-        if any(
-                d for d in self.tower
-                if d and d["color"] in self.wish_colors and not d["wish_triggered"]
-        ):
-            return False
+    # 检查是否有重复颜色
+    return _no_duplicates(tower)
+
+
+@njit(cache=True, boundscheck=False)
+def _apply_milk(cum, milk_counts, milk_used, tower, tower_n, basket, bn, log, log_n, rnd, dolls, gifts):
+    """应用奶操作"""
+    if milk_used >= milk_counts.shape[0]:
+        return False, milk_used, tower_n, bn, log_n
+
+    milk_count = milk_counts[milk_used]
+    if milk_count <= 0:
+        return False, milk_used, tower_n, bn, log_n
+
+    # 放置到宝塔，剩余的放入小筐
+    filled = 0
+    for i in range(TOWER_N):
+        if tower[i] < 0 and filled < milk_count:
+            tower[i] = _draw1(cum)
+            filled += 1
+    bn = _fill_basket(cum, basket, bn, milk_count - filled)
+
+    tower_n += filled
+    milk_used += 1
+    log_n = _log_write(log, log_n, rnd, EV_MILK, tower, tower_n, bn, dolls, gifts, milk_used, milk_count)
+    return True, milk_used, tower_n, bn, log_n
+
+
+@njit(cache=True, boundscheck=False)
+def _simulate_core(cum, initial_draw, wish_mask, milk_counts, max_rounds, basket, log, seed):
+    """单局游戏的热循环（纯整型状态，日志写入预分配数组）"""
+    np.random.seed(seed)
+    n_colors = cum.shape[0]
+
+    tower = np.full(TOWER_N, -1, dtype=np.int8)
+    bn = 0
+    dolls = 0
+    gifts = 0
+    rnd = 0
+    log_n = 0
+    milk_used = 0
+
+    # 初始抽取
+    n0 = min(TOWER_N, initial_draw)
+    for i in range(n0):
+        tower[i] = _draw1(cum)
+    tower_n = n0
+    bn = _fill_basket(cum, basket, bn, initial_draw - n0)
+    log_n = _log_write(log, log_n, rnd, EV_INIT, tower, tower_n, bn, dolls, gifts, initial_draw, 0)
+
+    ended = False
+    while rnd < max_rounds:
+        rnd += 1
+
+        # 执行处理步骤（四个阶段融合为一次扫描）
+        bn, tower_n, dolls, gifts, log_n = _process_round_phases(
+            cum, wish_mask, n_colors, tower, tower_n, basket, bn, log, log_n, rnd, dolls, gifts)
 
-        # 检查是否有重复颜色
-        colors = [d["color"] for d in self.tower if d]
-        return len(colors) == len(set(colors))
+        # 补货阶段
+        tower_n, bn, log_n = _refill_tower(tower, tower_n, basket, bn, log, log_n, rnd, dolls, gifts)
 
-    def apply_milk(self):
-        """应用奶操作"""
-        if self.milk_used >= len(self.milk_counts):
-            return False
+        # 检查终止条件
+        if _should_terminate(wish_mask, tower, bn):
+            # 尝试应用奶操作
+            ok, milk_used, tower_n, bn, log_n = _apply_milk(
+                cum, milk_counts, milk_used, tower, tower_n, basket, bn, log, log_n, rnd, dolls, gifts)
+            if ok:
+                continue
 
-        milk_count = self.milk_counts[self.milk_used]
-        if milk_count <= 0:
-            return False
+            # 游戏结束时清空宝塔
+            if tower_n > 0:
+                dolls += tower_n
+                for i in range(TOWER_N):
+                    tower[i] = -1
+                remaining = tower_n
+                tower_n = 0
+                log_n = _log_write(log, log_n, rnd, EV_END_NORMAL, tower, tower_n, bn, dolls, gifts, remaining, 0)
+            ended = True
+            break
+
+    if not ended:
+        # 达到最大回合时清空宝塔
+        if tower_n > 0:
+            dolls += tower_n
+            for i in range(TOWER_N):
+                tower[i] = -1
+            remaining = tower_n
+            tower_n = 0
+            log_n = _log_write(log, log_n, rnd, EV_END_MAXROUND, tower, tower_n, bn, dolls, gifts, remaining, 0)
+
+    return dolls, gifts, rnd, log_n
+
+
+@njit(parallel=True, cache=True, boundscheck=False)
+def _run_all(n_games, cum, initial_draw, wish_mask, milk_counts, max_rounds, base_seed,
+             baskets, logs, out_results, out_log_counts):
+    """并行驱动：各局游戏相互独立，按核心数并行模拟"""
+    for g in prange(n_games):
+        seed = (base_seed + g) & 0x7FFFFFFF
+        dolls, gifts, rounds, log_n = _simulate_core(
+            cum, initial_draw, wish_mask, milk_counts, max_rounds, baskets[g], logs[g], seed)
+        out_results[g, 0] = dolls
+        out_results[g, 1] = gifts
+        out_results[g, 2] = rounds
+        out_log_counts[g] = log_n
+
+
+def _decode_logs(game_id, log, log_n, population):
+    """将整型日志行解码为原始的文本日志格式"""
+    logs = []
+    for row in log[:log_n]:
+        ev = int(row[1])
+        bits = int(row[11])
+        tower = " | ".join(
+            f"{population[c]: <3}{'*' if (bits >> i) & 1 else ' '}" if c >= 0 else "●   "
+            for i, c in enumerate(row[2:11])
+        )
+        event = EVENT_TEXTS[ev].format(a=int(row[16]), b=int(row[17]))
+        logs.append([
+            game_id,
+            int(row[0]),
+            EVENT_PHASES[ev],
+            tower,
+            int(row[12]),
+            int(row[13]),
+            int(row[14]),
+            int(row[15]),
+            event,
+        ])
+    return logs
+
+
+def logs_to_dataframe(game_ids, log_rows, population):
+    """由压平的整型日志行一次性构建日志 DataFrame（文本列在此统一解码）"""
+    events = log_rows[:, 1]
+    return pd.DataFrame({
+        "游戏ID": game_ids,
+        "回合数": log_rows[:, 0],
+        "阶段": pd.Categorical.from_codes(EVENT_PHASE_CODES[events], categories=PHASE_NAMES),
+        "宝塔状态": [
+            " | ".join(
+                f"{population[c]: <3}{'*' if (row[11] >> i) & 1 else ' '}" if c >= 0 else "●   "
+                for i, c in enumerate(row[2:11])
+            )
+            for row in log_rows
+        ],
+        "小筐数量": log_rows[:, 12],
+        "收获娃娃": log_rows[:, 13],
+        "大礼包数": log_rows[:, 14],
+        "塔上娃娃": log_rows[:, 15],
+        "事件描述": pd.Categorical([
+            EVENT_TEXTS[e].format(a=a, b=b)
+            for e, a, b in zip(events, log_rows[:, 16], log_rows[:, 17])
+        ]),
+    })
+
+
+def _prepare_sim_args(config, max_rounds):
+    """把配置转换为热循环所需的类型化数组和缓冲区尺寸"""
+    population = config["population"]
+    cum = config.get("cum_weights")
+    if cum is None:
+        cum = np.cumsum(np.asarray(config["ratios"], dtype=np.float64))
+
+    # 许愿色做成布尔掩码，热循环里按颜色编号 O(1) 查询
+    wish_mask = config.get("wish_mask")
+    if wish_mask is None:
+        wish_ids = np.array([population.index(c) for c in config["wish_colors"]], dtype=np.int64)
+        wish_mask = np.zeros(len(population), dtype=np.bool_)
+        wish_mask[wish_ids] = True
+
+    milk_counts = np.asarray(config["milk_counts"], dtype=np.int32)
+    initial_draw = int(config["initial_draw"])
+
+    # 小筐容量上界：初始抽取 + 每回合补货上限 + 奶操作补货
+    basket_cap = initial_draw + 27 * max_rounds + int(milk_counts.sum()) + 9
+    max_logs = min(max_rounds * 10 + 4, MAX_LOGS_PER_GAME)
+    return cum, wish_mask, milk_counts, initial_draw, basket_cap, max_logs
 
-        # 从population中随机抽取娃娃
-        new_dolls = random.choices(self.population, weights=self.ratios, k=milk_count)
 
-        # 放置到宝塔
-        filled = 0
-        for i in range(9):
-            if self.tower[i] is None:
-                self.tower[i] = {"color": new_dolls[filled], "wish_triggered": False}
-                filled += 1
-                if filled >= milk_count:
-                    break
+def simulate_game(game_id, config, max_rounds=100):
+    """单局游戏模拟"""
+    cum, wish_mask, milk_counts, initial_draw, basket_cap, max_logs = _prepare_sim_args(config, max_rounds)
+    basket = np.empty(basket_cap, dtype=np.int8)
+    log = np.empty((max_logs, LOG_W), dtype=np.int32)
 
-        # 剩余的放入小筐
-        self.small_basket.extend(new_dolls[filled:])
+    seed = random.randrange(2 ** 31)
+    harvest_dolls, harvest_gifts, rounds, log_n = _simulate_core(
+        cum, initial_draw, wish_mask, milk_counts, max_rounds, basket, log, seed)
 
-        self.milk_used += 1
-        self.log_event("奶操作", f"应用第{self.milk_used}次奶，补充{milk_count}个娃娃")
-        return True
+    # 最终礼包兑换
+    exchange = harvest_dolls // config["doll_exchange"]
+    harvest_gifts += exchange
+    final_dolls = harvest_dolls % config["doll_exchange"]
 
+    return {
+        "dolls": final_dolls,
+        "gifts": harvest_gifts,
+        "rounds": rounds
+    }, _decode_logs(game_id, log, log_n, config["population"])
 
-def simulate_game(game_id, config, max_rounds=100):
-    """单局游戏模拟"""
-    state = GameState(
-        game_id=game_id,
-        population=config["population"],
-        ratios=config["ratios"],
-        initial_draw=config["initial_draw"],
-        wish_colors=config["wish_colors"],
-        milk_counts=config["milk_counts"]
-    )
 
-    while state.round_number < max_rounds:
-        state.round_number += 1
+def run_games(config, n_games, max_rounds=100, detailed_logs=True):
+    """批量游戏模拟：每局独立，多核并行执行"""
+    cum, wish_mask, milk_counts, initial_draw, basket_cap, max_logs = _prepare_sim_args(config, max_rounds)
 
-        # 执行处理步骤
-        state.process_wish()
-        state.process_groups()
-        state.process_duplicates()
-        state.process_special_gift()
+    # 不导出详细日志时日志预算为0，热循环里完全不做日志写入
+    if not detailed_logs:
+        max_logs = 0
 
-        # 补货阶段
-        state.refill_tower()
+    # 预分配每局独立的小筐、日志与结果缓冲区
+    baskets = np.empty((n_games, basket_cap), dtype=np.int8)
+    logs = np.empty((n_games, max_logs, LOG_W), dtype=np.int32)
+    out_results = np.empty((n_games, 3), dtype=np.int64)
+    out_log_counts = np.empty(n_games, dtype=np.int64)
 
-        # 检查终止条件
-        if state.should_terminate():
-            # 尝试应用奶操作
-            if state.apply_milk():
-                continue
+    base_seed = random.randrange(2 ** 31)
+    _run_all(n_games, cum, initial_draw, wish_mask, milk_counts, max_rounds, base_seed,
+             baskets, logs, out_results, out_log_counts)
 
-            # 游戏结束时清空宝塔
-            remaining = sum(1 for d in state.tower if d)
-            if remaining > 0:
-                state.harvest_dolls += remaining
-                state.tower = [None] * 9
-                state.log_event("游戏结束", f"清空宝塔，收获{remaining}个娃娃，正常终止")
-            break
-    else:
-        # 达到最大回合时清空宝塔
-        remaining = sum(1 for d in state.tower if d)
-        if remaining > 0:
-            state.harvest_dolls += remaining
-            state.tower = [None] * 9
-            state.log_event("游戏结束", f"达到最大回合，清空宝塔收获{remaining}个娃娃")
+    results = []
+    for g in range(n_games):
+        harvest_dolls, harvest_gifts, rounds = (int(v) for v in out_results[g])
 
-    # 最终礼包兑换
-    exchange = state.harvest_dolls // config["doll_exchange"]
-    state.harvest_gifts += exchange
-    final_dolls = state.harvest_dolls % config["doll_exchange"]
+        # 最终礼包兑换
+        exchange = harvest_dolls // config["doll_exchange"]
+        results.append([g + 1, harvest_dolls % config["doll_exchange"], harvest_gifts + exchange, rounds])
 
-    return {
-        "dolls": final_dolls,
-        "gifts": state.harvest_gifts,
-        "rounds": state.round_number
-    }, state.logs
+    # 把各局日志压平成单个整型数组，游戏ID按行数重复展开
+    game_ids = np.repeat(np.arange(1, n_games + 1), out_log_counts)
+    log_rows = logs[np.arange(max_logs) < out_log_counts[:, None]]
+    return results, game_ids, log_rows
 
 
 def run_simulation(doll_config_red, doll_config_orange, doll_config_yellow, doll_config_green, doll_config_blue,
                    doll_config_purple, doll_config_pink, doll_config_black, doll_config_white, doll_config_brown,
                    doll_config_gray, doll_config_gold, doll_config_silver, wish_colors, initial_draw, doll_exchange,
-                   total_games, max_rounds, milk1, milk2, milk3):
+                   total_games, max_rounds, milk1, milk2, milk3, detailed_logs=True, output_format="xlsx"):
     """批量运行模拟（支持多选许愿色）"""
     try:
         # 将各个颜色的数值拼接成字符串，传递给 parse_doll_config
         doll_config = f"{doll_config_red},{doll_config_orange},{doll_config_yellow},{doll_config_green},{doll_config_blue},{doll_config_purple},{doll_config_pink},{doll_config_black},{doll_config_white},{doll_config_brown},{doll_config_gray},{doll_config_gold},{doll_config_silver}"
         population, ratios = parse_doll_config(doll_config)
+
+        # 检查许愿色是否在娃娃颜色列表中
+        for color in wish_colors:
+            if color not in population:
+                return f"错误：许愿色 {color} 不在娃娃颜色列表中！", None
+
+        # 配置只解析一次就转成类型化数组：累积权重、许愿色编号与掩码
+        # 整次运行构建一份，所有游戏的抽样与掩码操作直接复用
+        population = tuple(population)
+        ratios = np.asarray(ratios, dtype=np.float64)
+        wish_ids = np.fromiter((population.index(c) for c in wish_colors), dtype=np.int8, count=len(wish_colors))
+        wish_mask = np.zeros(len(population), dtype=np.bool_)
+        wish_mask[wish_ids] = True
         config = {
             "population": population,
             "ratios": ratios,
+            "cum_weights": np.cumsum(ratios),
             "initial_draw": int(initial_draw),
             "wish_colors": wish_colors,
+            "wish_ids": wish_ids,
+            "wish_mask": wish_mask,
             "doll_exchange": int(doll_exchange),
             "milk_counts": [int(milk1), int(milk2), int(milk3)]  # 新增奶参数
         }
 
-        # 检查许愿色是否在娃娃颜色列表中
-        for color in wish_colors:
-            if color not in population:
-                return f"错误：许愿色 {color} 不在娃娃颜色列表中！", None
-
-        results = []
-        all_logs = []
+        results, game_ids, log_rows = run_games(config, int(total_games), max_rounds, detailed_logs)
 
-        for game_id in range(1, int(total_games) + 1):
-            result, logs = simulate_game(game_id, config, max_rounds)
-            results.append([game_id, result["dolls"], result["gifts"], result["rounds"]])
-            all_logs.extend(logs)
-
-        # 生成数据文件
-        df_logs = pd.DataFrame(all_logs, columns=[
-            "游戏ID", "回合数", "阶段", "宝塔状态", "小筐数量",
-            "收获娃娃", "大礼包数", "塔上娃娃", "事件描述"
-        ])
+        # 生成数据文件：只在需要导出详细日志时才解码文本列
+        df_logs = logs_to_dataframe(game_ids, log_rows, population) if detailed_logs else None
         df_results = pd.DataFrame(results, columns=[
             "游戏ID", "收获娃娃", "大礼包数", "总回合数"
         ])
@@ -352,38 +569,57 @@ def run_simulation(doll_config_red, doll_config_orange, doll_config_yellow, doll
                    milk1, milk2, milk3]
         })
 
-        # 将数据保存为临时文件
+        # 大批量模拟走列式/文本快速通道：跳过 xlsx 的逐单元格写入与样式
+        fmt = output_format.split()[0] if output_format else "xlsx"
+        if fmt in ("parquet", "csv"):
+            # 详细日志是数据量大头；未勾选详细日志时退回导出汇总表
+            df_export = df_logs if detailed_logs else df_results
+            with tempfile.NamedTemporaryFile(delete=False, suffix=f".{fmt}") as tmp:
+                if fmt == "parquet":
+                    df_export.to_parquet(tmp.name, index=False)
+                else:
+                    df_export.to_csv(tmp.name, index=False, encoding="utf-8-sig")
+                tmp_path = tmp.name
+            return tmp_path, df_results
+
+        # 将数据保存为临时文件：流式只写模式，避免整本工作簿驻留内存和二次加载
         with tempfile.NamedTemporaryFile(delete=False, suffix=".xlsx") as tmp:
-            with pd.ExcelWriter(tmp.name, engine="openpyxl") as writer:
-                df_logs.to_excel(writer, sheet_name="详细日志", index=False)
-                df_results.to_excel(writer, sheet_name="汇总结果", index=False)
-                df_params.to_excel(writer, sheet_name="参数设置", index=False)  # 新增参数表
-
-            # 加载Excel文件以设置样式
-            wb = load_workbook(tmp.name)
-            ws = wb["详细日志"]
-
-            # 设置“宝塔状态”列的列宽
-            column_letter = get_column_letter(df_logs.columns.get_loc("宝塔状态") + 1)  # +1因为Excel列索引从1开始
-            ws.column_dimensions[column_letter].width = 15  # 设置列宽为15
-
-            # 设置行背景颜色
-            for row in range(2, len(df_logs) + 2):  # 从第二行开始
-                phase = df_logs.iloc[row - 2]["阶段"]
-                if phase == "新一轮放娃":
-                    # 设置整行背景颜色为浅灰色
-                    for col in range(1, len(df_logs.columns) + 1):
-                        ws.cell(row=row, column=col).fill = PatternFill(start_color='EDEDED', end_color='EDEDED',
-                                                                        fill_type='solid')
-                elif phase == "初始化":
-                    # 设置整行背景颜色为中灰色
-                    for col in range(1, len(df_logs.columns) + 1):
-                        ws.cell(row=row, column=col).fill = PatternFill(start_color='D3D3D3', end_color='D3D3D3',
-                                                                        fill_type='solid')
-
-            # 保存修改
-            wb.save(tmp.name)
+            wb = Workbook(write_only=True)
+
+            if detailed_logs:
+                ws = wb.create_sheet("详细日志")
+
+                # 设置“宝塔状态”列的列宽
+                column_letter = get_column_letter(df_logs.columns.get_loc("宝塔状态") + 1)  # +1因为Excel列索引从1开始
+                ws.column_dimensions[column_letter].width = 15  # 设置列宽为15
+
+                ws.append(list(df_logs.columns))
+
+                # 设置行背景颜色：共享两个填充对象，写入时按阶段着色
+                fill_light = PatternFill(start_color='EDEDED', end_color='EDEDED', fill_type='solid')  # 浅灰色
+                fill_mid = PatternFill(start_color='D3D3D3', end_color='D3D3D3', fill_type='solid')  # 中灰色
+                phase_idx = df_logs.columns.get_loc("阶段")
+                for row in df_logs.itertuples(index=False, name=None):
+                    phase = row[phase_idx]
+                    if phase == "新一轮放娃":
+                        fill = fill_light
+                    elif phase == "初始化":
+                        fill = fill_mid
+                    else:
+                        ws.append(row)
+                        continue
+                    cells = [WriteOnlyCell(ws, value=v) for v in row]
+                    for cell in cells:
+                        cell.fill = fill
+                    ws.append(cells)
+
+            for sheet_name, df in (("汇总结果", df_results), ("参数设置", df_params)):
+                ws = wb.create_sheet(sheet_name)
+                ws.append(list(df.columns))
+                for row in df.itertuples(index=False, name=None):
+                    ws.append(row)
 
+            wb.save(tmp.name)
             tmp_path = tmp.name
 
         return tmp_path, df_results
@@ -446,6 +682,15 @@ with gr.Blocks(title="娃娃宝塔模拟器") as demo:
                 step=1,
                 visible=False
             )
+            detailed_logs = gr.Checkbox(
+                label="导出详细日志（大批量模拟时建议关闭）",
+                value=True
+            )
+            output_format = gr.Dropdown(
+                label="输出格式",
+                choices=["xlsx (小规模)", "parquet (大规模推荐)", "csv"],
+                value="xlsx (小规模)"
+            )
             btn_run = gr.Button("开始模拟", variant="primary")
 
         with gr.Column(scale=3):
@@ -462,7 +707,7 @@ with gr.Blocks(title="娃娃宝塔模拟器") as demo:
         inputs=[doll_config_red, doll_config_orange, doll_config_yellow, doll_config_green, doll_config_blue,
                 doll_config_purple, doll_config_pink, doll_config_black, doll_config_white, doll_config_brown,
                 doll_config_gray, doll_config_gold, doll_config_silver, wish_colors, initial_draw, doll_exchange,
-                total_games, max_rounds, milk1, milk2, milk3],
+                total_games, max_rounds, milk1, milk2, milk3, detailed_logs, output_format],
         outputs=[file_output, result_table]
     )
 